@@ -0,0 +1,108 @@
+import profiling
+from router import default_home_positions, interaction_nodes, shortest_path
+
+
+def travel_distances(graph, homes):
+    """
+    Distance from each ion's home to each interaction node.
+
+    Paths avoid the homes of the other ions.
+
+    Args:
+        graph (nx.Graph): The graph representing the Penning trap.
+        homes (list): The home position of each ion.
+
+    Returns:
+        list: For each ion, a dict mapping interaction nodes to distances.
+    """
+    distances = []
+    for home in homes:
+        blocked = set(homes) - {home}
+        distances.append(
+            {
+                zone: len(shortest_path(graph, home, zone, blocked)) - 1
+                for zone in interaction_nodes(graph)
+            }
+        )
+    return distances
+
+
+@profiling.timed("allocate")
+def allocate(layers, graph, homes=None, balance_weight=1.0, wait_weight=1.0):
+    """
+    Assign each MS gate to an interaction node and a start tick.
+
+    Gates are visited in circuit order while keeping track of when every ion
+    is back home and when every interaction node is free again. For each MS
+    gate the interaction node minimizing
+
+        travel distance of both ions
+        + balance_weight * number of MS gates already on that node
+        + wait_weight * ticks spent waiting for the node
+
+    is chosen. A node is considered free as soon as the previous pair starts
+    leaving, so the next pair walks towards it while the current two-tick MS
+    gate is still running.
+
+    Args:
+        layers (list): A list of layers, each a list of gates.
+        graph (nx.Graph): The graph representing the Penning trap.
+        homes (list): The home position of each ion. Defaults to
+            `default_home_positions`.
+        balance_weight (float): Cost of one MS gate already placed on a node.
+        wait_weight (float): Cost of one tick of waiting for a node.
+
+    Returns:
+        list: The annotated schedule, a list of (gate, zone, tick) in circuit
+        order. For single qubit gates the zone is None. The tick is the
+        earliest tick the gate is expected to happen at.
+    """
+    if homes is None:
+        homes = default_home_positions(graph)
+    distances = travel_distances(graph, homes)
+    zones = interaction_nodes(graph)
+
+    back_home = [0] * len(homes)
+    last_gate = [-1] * len(homes)
+    zone_free = {zone: 0 for zone in zones}
+    load = {zone: 0 for zone in zones}
+
+    annotated = []
+    for layer in layers:
+        for gate in layer:
+            if gate[0] != "MS":
+                ion = gate[2]
+                tick = last_gate[ion] + 1
+                last_gate[ion] = tick
+                annotated.append((gate, None, tick))
+                continue
+
+            ion_0, ion_1 = gate[2]
+            depart_0 = max(back_home[ion_0], last_gate[ion_0])
+            depart_1 = max(back_home[ion_1], last_gate[ion_1])
+
+            def score(zone):
+                arrival = max(
+                    depart_0 + distances[ion_0][zone],
+                    depart_1 + distances[ion_1][zone],
+                )
+                tick = max(arrival, zone_free[zone])
+                cost = (
+                    distances[ion_0][zone]
+                    + distances[ion_1][zone]
+                    + balance_weight * load[zone]
+                    + wait_weight * (tick - arrival)
+                )
+                return cost, tick
+
+            zone = min(zones, key=score)
+            tick = score(zone)[1]
+
+            zone_free[zone] = tick + 2
+            load[zone] += 1
+            last_gate[ion_0] = last_gate[ion_1] = tick + 1
+            back_home[ion_0] = tick + 1 + distances[ion_0][zone]
+            back_home[ion_1] = tick + 1 + distances[ion_1][zone]
+            annotated.append((gate, zone, tick))
+
+    return annotated
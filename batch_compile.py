@@ -0,0 +1,152 @@
+import argparse
+import csv
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tabulate import tabulate
+
+import profiling
+from router import route_pipelined
+from trap import create_trap_graph
+from verifier import verify_structure, verify_equivalence
+
+SUMMARY_FIELDS = ["circuit", "qubits", "ticks", "ms_count", "fidelity", "compile_time", "error"]
+
+
+@profiling.timed("compile_circuit")
+def compile_circuit(qc, graph=None, compiler=route_pipelined):
+    """
+    Compile a Qiskit circuit onto the trap and verify the result.
+
+    The reference state is derived from the circuit itself.
+
+    Args:
+        qc (QuantumCircuit): The target circuit.
+        graph (nx.Graph): The graph representing the Penning trap. Defaults to
+            `create_trap_graph()`.
+        compiler (callable): Function turning (layers, graph) into a positions
+            history and a gates schedule.
+
+    Returns:
+        dict: The positions history, gates schedule, ticks, MS count, fidelity
+        and compile time.
+    """
+    from fidelity import fidelity
+    from transpile_qiskit import (
+        circuit_layers,
+        prepare_circuit,
+        reference_density_matrix,
+        transpile_native,
+    )
+
+    if graph is None:
+        graph = create_trap_graph()
+    start = time.perf_counter()
+    prepared = prepare_circuit(qc)
+    layers = circuit_layers(transpile_native(prepared))
+    positions_history, gates_schedule = compiler(layers, graph)
+    compile_time = time.perf_counter() - start
+
+    verify_structure(positions_history, gates_schedule, graph)
+    expected_result = reference_density_matrix(prepared)
+    verify_equivalence(gates_schedule, expected_result)
+    return {
+        "positions_history": positions_history,
+        "gates_schedule": gates_schedule,
+        "qubits": qc.num_qubits,
+        "ticks": len(positions_history),
+        "ms_count": sum(gate[0] == "MS" for step in gates_schedule for gate in step),
+        "fidelity": float(
+            fidelity(positions_history, gates_schedule, graph, expected_result=expected_result)
+        ),
+        "compile_time": compile_time,
+    }
+
+
+def compile_file(path, layout=None):
+    """
+    Compile and verify one OpenQASM file.
+
+    Args:
+        path (str): Path of the file.
+        layout (dict): Arguments passed to `create_trap_graph`.
+
+    Returns:
+        dict: One row of the summary, see `SUMMARY_FIELDS`.
+    """
+    from transpile_qiskit import load_circuit
+
+    row = {"circuit": os.path.basename(path)}
+    try:
+        result = compile_circuit(load_circuit(path), create_trap_graph(**(layout or {})))
+    except Exception as e:  # parse, transpile, routing and verification errors alike
+        row["error"] = f"{type(e).__name__}: {e}"
+        return row
+    row.update({k: result[k] for k in SUMMARY_FIELDS if k in result})
+    return row
+
+
+def batch_compile(directory, pattern="*.qasm", layout=None, max_workers=None):
+    """
+    Compile and verify every circuit of a directory in parallel.
+
+    Args:
+        directory (str): Directory holding the circuits.
+        pattern (str): Glob pattern of the circuit files.
+        layout (dict): Arguments passed to `create_trap_graph`.
+        max_workers (int): Number of worker processes. With 1, the circuits
+            are compiled in this process, which keeps them visible to `profiling`.
+
+    Returns:
+        list: One summary row per circuit, sorted by file name.
+    """
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+    if max_workers == 1:
+        return [compile_file(path, layout) for path in paths]
+    # Forked workers hang in Qiskit's thread pool once this process has transpiled.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        return list(executor.map(compile_file, paths, [layout] * len(paths)))
+
+
+def write_summary(rows, path):
+    """
+    Write the summary rows to a file, as CSV if the name ends in .csv and as
+    a text table otherwise.
+
+    Args:
+        rows (list): Summary rows returned by `batch_compile`.
+        path (str): Output file.
+    """
+    with open(path, "w", newline="") as f:
+        if path.endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            f.write(format_summary(rows) + "\n")
+
+
+def format_summary(rows):
+    """Format the summary rows as a text table."""
+    return tabulate(
+        [[row.get(k, "") for k in SUMMARY_FIELDS] for row in rows],
+        headers=SUMMARY_FIELDS,
+        floatfmt=".4f",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile and verify a directory of circuits.")
+    parser.add_argument("directory", help="directory holding the OpenQASM files")
+    parser.add_argument("--pattern", default="*.qasm", help="glob pattern of the circuit files")
+    parser.add_argument("--output", default="summary.txt", help="summary file, .csv for CSV")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args()
+
+    rows = batch_compile(args.directory, args.pattern, max_workers=args.workers)
+    write_summary(rows, args.output)
+    print(format_summary(rows))
@@ -0,0 +1,242 @@
+"""
+Schedule compaction.
+
+Hand-built and heuristic schedules contain slack: steps where nothing moves and
+no gate runs, and gates that wait behind moves they don't depend on. Every step
+still heats every ion, so `compact` removes what it can without changing the
+circuit:
+
+- a step is merged into its predecessor or successor when their gates act on
+  different ions and the merged schedule passes the verifier,
+- each move of each ion is pulled back, one step at a time, as long as the
+  verifier accepts the ion arriving a step sooner,
+- single qubit gates are pulled back to the earliest step since their ion last
+  moved or ran a gate.
+
+`compact` repeats the passes until none of them changes anything, so in the
+result no step can be merged, and no single move or gate can be pulled earlier.
+Gates only ever swap places with gates on other ions, so the order of the gates
+on every ion, and therefore the circuit, is unchanged.
+"""
+
+import profiling
+from noise_model import get_temperatures
+from verifier import verify_structure
+
+
+def _wires(gate):
+    return gate[2] if gate[0] == "MS" else (gate[2],)
+
+
+def _step_wires(step):
+    return {w for gate in step for w in _wires(gate)}
+
+
+def _has_ms(step):
+    return any(gate[0] == "MS" for gate in step)
+
+
+def _valid_around(positions_history, gates_schedule, graph, lo, hi):
+    """
+    Check steps `lo` to `hi` of a schedule whose other steps are known to be legal.
+
+    The window is widened to steps that don't depend on the steps outside it:
+    its first step must not follow an MS gate, which could justify an overlap,
+    and its last step must not hold one, which needs the next positions.
+    """
+    start = max(lo, 0)
+    while start > 0 and _has_ms(gates_schedule[start - 1]):
+        start -= 1
+    stop = min(hi + 1, len(gates_schedule) - 1)
+    while stop < len(gates_schedule) - 1 and _has_ms(gates_schedule[stop]):
+        stop += 1
+    try:
+        verify_structure(
+            positions_history[start:stop + 1], gates_schedule[start:stop + 1], graph
+        )
+    except ValueError:
+        return False
+    return True
+
+
+@profiling.timed("hoist_gates")
+def hoist_gates(positions_history, gates_schedule):
+    """
+    Move every single qubit gate to the earliest step where its ion is already
+    in place and free.
+
+    Args:
+        positions_history (list): A list of positions for each step in the circuit.
+        gates_schedule (list): A list of gates where each gate is represented as a tuple.
+
+    Returns:
+        tuple: The new gates schedule and the number of gates moved.
+    """
+    gates_schedule = [list(step) for step in gates_schedule]
+    # Last step each ion moved or ran a gate at.
+    busy = [0] * len(positions_history[0])
+    moved = 0
+    for i, step in enumerate(gates_schedule):
+        for ion in range(len(busy)):
+            if i > 0 and positions_history[i][ion] != positions_history[i - 1][ion]:
+                busy[ion] = i
+        for gate in list(step):
+            if gate[0] != "MS" and busy[gate[2]] < i:
+                target = busy[gate[2]]
+                # Step `target` may still run the previous gate on this ion.
+                if gate[2] in _step_wires(gates_schedule[target]):
+                    target += 1
+                if target < i:
+                    step.remove(gate)
+                    gates_schedule[target].append(gate)
+                    moved += 1
+                    busy[gate[2]] = target
+                    continue
+            for w in _wires(gate):
+                busy[w] = i
+    return gates_schedule, moved
+
+
+@profiling.timed("hoist_moves")
+def hoist_moves(positions_history, gates_schedule, graph):
+    """
+    Pull every move of every ion to the earliest step the verifier accepts,
+    one step at a time, by having the ion reach its new node a step sooner.
+
+    The first positions are kept, so the initial placement is unchanged.
+
+    Args:
+        positions_history (list): A list of positions for each step in the circuit.
+        gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        graph (networkx.Graph): The graph representing the Penning trap.
+
+    Returns:
+        tuple: The new positions history and the number of steps moves were pulled by.
+    """
+    positions_history = [list(positions) for positions in positions_history]
+    hoisted = 0
+    for i in range(2, len(positions_history)):
+        for ion in range(len(positions_history[i])):
+            j = i
+            while j > 1 and positions_history[j][ion] != positions_history[j - 1][ion]:
+                previous = positions_history[j - 1][ion]
+                positions_history[j - 1][ion] = positions_history[j][ion]
+                if not _valid_around(positions_history, gates_schedule, graph, j - 2, j):
+                    positions_history[j - 1][ion] = previous
+                    break
+                hoisted += 1
+                j -= 1
+    return positions_history, hoisted
+
+
+@profiling.timed("merge_steps")
+def merge_steps(positions_history, gates_schedule, graph):
+    """
+    Drop steps by merging each one into a neighbour, keeping the positions of
+    the neighbour, wherever the verifier accepts the result.
+
+    Args:
+        positions_history (list): A list of positions for each step in the circuit.
+        gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        graph (networkx.Graph): The graph representing the Penning trap.
+
+    Returns:
+        tuple: The new positions history and gates schedule.
+    """
+    positions_history = list(positions_history)
+    gates_schedule = [list(step) for step in gates_schedule]
+    i = 1
+    while i < len(positions_history):
+        merged = False
+        # Merge into the previous step first, which also pulls the gates earlier.
+        for keep in (i - 1, i + 1):
+            if keep >= len(positions_history):
+                continue
+            if _step_wires(gates_schedule[i]) & _step_wires(gates_schedule[keep]):
+                continue
+            first, second = min(i, keep), max(i, keep)
+            new_positions = positions_history[:i] + positions_history[i + 1:]
+            new_gates = (
+                gates_schedule[:first]
+                + [gates_schedule[first] + gates_schedule[second]]
+                + gates_schedule[second + 1:]
+            )
+            if _valid_around(new_positions, new_gates, graph, first - 1, first + 1):
+                positions_history, gates_schedule = new_positions, new_gates
+                merged = True
+                break
+        if merged:
+            # The merged step may now merge with the step before it.
+            i = max(i - 1, 1)
+        else:
+            i += 1
+    return positions_history, gates_schedule
+
+
+def compaction_report(before, after, graph):
+    """
+    Compare the length and heating of two positions histories.
+
+    Args:
+        before (list): The positions history before compaction.
+        after (list): The positions history after compaction.
+        graph (networkx.Graph): The graph representing the Penning trap.
+
+    Returns:
+        dict: Ticks and final ion temperatures (summed and peak) before and after,
+        and the savings.
+    """
+    report = {}
+    for name, positions_history in (("before", before), ("after", after)):
+        final = get_temperatures(positions_history, graph)[-1]
+        report[f"ticks_{name}"] = len(positions_history)
+        report[f"temperature_{name}"] = sum(final)
+        report[f"peak_temperature_{name}"] = max(final)
+    report["ticks_saved"] = report["ticks_before"] - report["ticks_after"]
+    report["temperature_saved"] = report["temperature_before"] - report["temperature_after"]
+    return report
+
+
+def compact(positions_history, gates_schedule, graph):
+    """
+    Remove the slack of a legal schedule.
+
+    Args:
+        positions_history (list): A list of positions for each step in the circuit.
+        gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        graph (networkx.Graph): The graph representing the Penning trap.
+
+    Returns:
+        tuple: The compacted positions history and gates schedule, and the
+        report of `compaction_report`.
+    """
+    verify_structure(positions_history, gates_schedule, graph)
+    new_positions, new_gates = positions_history, gates_schedule
+    while True:
+        length = len(new_positions)
+        # Merging first drops the empty steps, which would otherwise let the
+        # first ions hoisted take nodes the others need.
+        new_positions, new_gates = merge_steps(new_positions, new_gates, graph)
+        new_positions, hoisted = hoist_moves(new_positions, new_gates, graph)
+        new_gates, moved = hoist_gates(new_positions, new_gates)
+        if len(new_positions) == length and not hoisted and not moved:
+            break
+    verify_structure(new_positions, new_gates, graph)
+    return new_positions, new_gates, compaction_report(positions_history, new_positions, graph)
+
+
+if __name__ == "__main__":
+    from tabulate import tabulate
+
+    from router import route, route_pipelined
+    from transpile_qiskit import layers
+    from trap import create_trap_graph
+
+    graph = create_trap_graph()
+    rows = []
+    for name, compiler in (("baseline", route), ("pipelined", route_pipelined)):
+        _, _, report = compact(*compiler(layers, graph), graph)
+        rows.append([name, report["ticks_before"], report["ticks_after"],
+                     report["temperature_before"], report["temperature_after"]])
+    print(tabulate(rows, headers=["router", "ticks", "compacted", "temperature", "compacted"],
+                   floatfmt=".2f"))
@@ -0,0 +1,327 @@
+"""
+Long-lived compile service.
+
+Importing Qiskit and PennyLane, building the trap graph, transpiling the target
+circuit and simulating the reference state takes longer than compiling a
+schedule. The service does all of that once and then answers requests, one JSON
+object per line, over a local TCP socket or stdin/stdout:
+
+    {"id": 1, "op": "ping"}
+    {"id": 2, "op": "compile", "layout": {"rows": 5, "cols": 7, "interaction_nodes": [[1, 1], [3, 3]]}}
+    {"id": 3, "op": "compile", "qasm": "OPENQASM 2.0; ..."}
+    {"id": 4, "op": "verify", "positions_history": [...], "gates_schedule": [...]}
+    {"id": 5, "op": "shutdown"}
+
+The target circuit is the QFT(8) unless an OpenQASM program is given in "qasm".
+
+Every response echoes the request id and has "ok" set, plus either the result
+fields or "error". The output printed by the verifier is returned in "log".
+
+    python compile_server.py serve [--port 8765 | --stdio]
+    python compile_server.py call '{"op": "compile"}'
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+def parse_positions_history(positions_history):
+    """Turn JSON lists back into the tuples used as graph nodes."""
+    return [[tuple(p) for p in positions] for positions in positions_history]
+
+
+def parse_gates_schedule(gates_schedule):
+    """Turn JSON lists back into gate tuples."""
+    return [
+        [
+            (name, param, tuple(wires) if isinstance(wires, list) else wires)
+            for name, param, wires in step
+        ]
+        for step in gates_schedule
+    ]
+
+
+class CompileService:
+    """
+    Keep the trap models, transpiled circuits, reference states and simulators
+    in memory between requests.
+
+    The heavy modules are imported here rather than at module level, so that
+    clients importing this module stay light.
+    """
+
+    def __init__(self):
+        import transpile_qiskit
+        import verifier
+
+        self._graphs = {}
+        self._targets = {None: (transpile_qiskit.layers, verifier.circuit())}
+        self._results = {}
+        self.graph()
+
+    def target(self, qasm=None):
+        """Gate layers and reference state of a circuit, transpiled once per circuit."""
+        if qasm not in self._targets:
+            from transpile_qiskit import (
+                circuit_from_qasm,
+                circuit_layers,
+                prepare_circuit,
+                reference_density_matrix,
+                transpile_native,
+            )
+
+            prepared = prepare_circuit(circuit_from_qasm(qasm))
+            self._targets[qasm] = (
+                circuit_layers(transpile_native(prepared)),
+                reference_density_matrix(prepared),
+            )
+        return self._targets[qasm]
+
+    def graph(self, layout=None):
+        """Trap graph of a layout, built once per layout."""
+        layout = layout or {}
+        nodes = layout.get("interaction_nodes")
+        if nodes is not None:
+            nodes = frozenset(tuple(n) for n in nodes)
+        key = (layout.get("rows", 5), layout.get("cols", 7), nodes)
+        if key not in self._graphs:
+            from trap import create_trap_graph
+
+            self._graphs[key] = create_trap_graph(key[0], key[1], nodes)
+        return key, self._graphs[key]
+
+    def check(self, positions_history, gates_schedule, graph, expected_result):
+        """Run the verifier and the noisy simulation on a schedule."""
+        from fidelity import fidelity
+        import verifier
+
+        verifier.verifier(
+            positions_history, gates_schedule, graph, expected_result=expected_result
+        )
+        return {
+            "ticks": len(positions_history),
+            "fidelity": float(
+                fidelity(
+                    positions_history,
+                    gates_schedule,
+                    graph,
+                    expected_result=expected_result,
+                )
+            ),
+        }
+
+    def compile(self, layout=None, qasm=None):
+        key, graph = self.graph(layout)
+        if (key, qasm) not in self._results:
+            from router import route_pipelined
+
+            layers, expected_result = self.target(qasm)
+            positions_history, gates_schedule = route_pipelined(layers, graph)
+            result = self.check(positions_history, gates_schedule, graph, expected_result)
+            result["ms_count"] = sum(g[0] == "MS" for step in gates_schedule for g in step)
+            result["positions_history"] = positions_history
+            result["gates_schedule"] = gates_schedule
+            self._results[key, qasm] = result
+        return self._results[key, qasm]
+
+    def verify(self, positions_history, gates_schedule, layout=None, qasm=None):
+        _, graph = self.graph(layout)
+        return self.check(
+            parse_positions_history(positions_history),
+            parse_gates_schedule(gates_schedule),
+            graph,
+            self.target(qasm)[1],
+        )
+
+    def handle(self, request):
+        """
+        Answer one request.
+
+        Args:
+            request (dict): The decoded request.
+
+        Returns:
+            dict: The response.
+        """
+        response = {"id": request.get("id")}
+        log = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(log):
+                op = request.get("op")
+                if op == "ping":
+                    result = {}
+                elif op == "compile":
+                    result = self.compile(request.get("layout"), request.get("qasm"))
+                elif op == "verify":
+                    result = self.verify(
+                        request["positions_history"],
+                        request["gates_schedule"],
+                        request.get("layout"),
+                        request.get("qasm"),
+                    )
+                else:
+                    raise ValueError(f"Unknown op: {op}")
+            response.update(result, ok=True)
+        except Exception as e:  # a bad request must not take the service down
+            response.update(ok=False, error=f"{type(e).__name__}: {e}")
+        response["log"] = log.getvalue()
+        return response
+
+
+async def _answer(service, executor, line):
+    try:
+        request = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {"id": None, "ok": False, "error": f"Invalid JSON: {e}"}
+    if not isinstance(request, dict):
+        return {"id": None, "ok": False, "error": "A request must be a JSON object."}
+    # Answered here rather than behind a running compile on the worker thread.
+    if request.get("op") == "ping":
+        return {"id": request.get("id"), "ok": True, "log": ""}
+    if request.get("op") == "shutdown":
+        return {"id": request.get("id"), "ok": True, "shutdown": True}
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, service.handle, request)
+
+
+async def _serve_stream(service, executor, reader, write, stop):
+    """Answer requests from one stream concurrently, in completion order."""
+    lock = asyncio.Lock()
+    tasks = set()
+
+    async def answer(line):
+        response = await _answer(service, executor, line)
+        async with lock:
+            await write((json.dumps(response) + "\n").encode())
+        if response.get("shutdown"):
+            stop.set()
+
+    while not stop.is_set():
+        line = await reader.readline()
+        if not line:
+            break
+        if line.strip():
+            task = asyncio.create_task(answer(line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, service=None):
+    """
+    Serve requests over a local TCP socket until a shutdown request.
+
+    Simulations share the PennyLane devices, so they run one at a time on a
+    worker thread while the event loop keeps accepting requests.
+    """
+    service = service or CompileService()
+    executor = ThreadPoolExecutor(max_workers=1)
+    stop = asyncio.Event()
+
+    async def client_connected(reader, writer):
+        async def write(data):
+            writer.write(data)
+            await writer.drain()
+
+        try:
+            await _serve_stream(service, executor, reader, write, stop)
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(client_connected, host, port)
+    print(f"Compile service listening on {host}:{port}", file=sys.stderr)
+    async with server:
+        await stop.wait()
+    executor.shutdown()
+
+
+async def serve_stdio(service=None):
+    """Serve requests read from stdin, writing the responses to stdout."""
+    service = service or CompileService()
+    executor = ThreadPoolExecutor(max_workers=1)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    stdout = sys.stdout.buffer
+
+    async def write(data):
+        stdout.write(data)
+        stdout.flush()
+
+    await _serve_stream(service, executor, reader, write, stop)
+    executor.shutdown()
+
+
+async def request(payloads, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Send requests to a running service over one connection.
+
+    Args:
+        payloads (list): The requests, as dicts. Missing ids are set to their index.
+        host (str): Address of the service.
+        port (int): Port of the service.
+
+    Returns:
+        list: The responses, in the order of the requests.
+    """
+    if not all(isinstance(payload, dict) for payload in payloads):
+        raise ValueError("Every request must be a JSON object.")
+    reader, writer = await asyncio.open_connection(host, port)
+    # The requests go out under their index, so repeated or null ids still
+    # match their responses, and the ids are restored on the way back.
+    for i, payload in enumerate(payloads):
+        writer.write((json.dumps({**payload, "id": i}) + "\n").encode())
+    await writer.drain()
+
+    responses = {}
+    while len(responses) < len(payloads):
+        line = await reader.readline()
+        if not line:
+            break
+        response = json.loads(line)
+        if response.get("id") in range(len(payloads)):
+            responses[response["id"]] = response
+    writer.close()
+    await writer.wait_closed()
+    for i, response in responses.items():
+        response["id"] = payloads[i].get("id", i)
+    return [responses.get(i) for i in range(len(payloads))]
+
+
+def call(op, host=DEFAULT_HOST, port=DEFAULT_PORT, **params):
+    """Send a single request and wait for its response."""
+    return asyncio.run(request([{"op": op, **params}], host, port))[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_parser = sub.add_parser("serve", help="start the service")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--stdio", action="store_true", help="use stdin/stdout")
+    call_parser = sub.add_parser("call", help="send requests to a running service")
+    call_parser.add_argument("requests", nargs="+", help="JSON requests")
+    call_parser.add_argument("--host", default=DEFAULT_HOST)
+    call_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        asyncio.run(serve_stdio() if args.stdio else serve(args.host, args.port))
+    else:
+        payloads = [json.loads(r) for r in args.requests]
+        for response in asyncio.run(request(payloads, args.host, args.port)):
+            print(json.dumps(response))
@@ -0,0 +1,447 @@
+"""
+Exact solver for small routing and scheduling windows.
+
+A window is a short stretch of a schedule: the positions of the ions at its
+first tick, the gates to run in circuit order and, optionally, the positions
+the ions have to end on. `solve_window` finds the plan with the fewest ticks,
+or the lowest summed heating, with an A* search over the joint positions of
+the ions that may move: the ions that take part in the window and any extra
+ions passed as `movable`. The other ions stay where they are, so the plan is
+optimal among the plans that leave them in place; pass every ion as movable
+for a plan that is optimal outright, at the price of a much larger search.
+
+Single qubit gates are applied as soon as their ion sits on a standard node,
+which never makes a plan worse, and an MS gate is applied as soon as its two
+ions meet on an interaction node, which the verifier requires anyway.
+"""
+
+import heapq
+import itertools
+
+import networkx as nx
+
+import profiling
+from noise_model import HEATING_IDLE, HEATING_MOVE, HEATING_STAY, heating
+from router import interaction_nodes
+
+
+def _colocated_pairs(positions):
+    """Pairs of indices sharing a node, or None if three or more ions share one."""
+    seen = {}
+    pairs = []
+    for i, p in enumerate(positions):
+        if p in seen:
+            if len(seen[p]) == 2:
+                return None
+            seen[p].append(i)
+            pairs.append(tuple(seen[p]))
+        else:
+            seen[p] = [i]
+    return pairs
+
+
+@profiling.timed("solve_window")
+def solve_window(
+    graph,
+    start_positions,
+    gates,
+    end_positions=None,
+    held=(),
+    movable=(),
+    objective="ticks",
+    max_ticks=40,
+    max_expansions=200000,
+):
+    """
+    Find an optimal plan for a window.
+
+    Only the ions that run gates, have to end elsewhere or are held, plus the
+    ions in `movable`, may move; the plan is optimal among those plans.
+
+    Args:
+        graph (nx.Graph): The graph representing the Penning trap.
+        start_positions (list): Positions of all ions at the first tick.
+        gates (list): The gates to run, in circuit order.
+        end_positions (list): Positions of all ions at the last tick. If None,
+            the ions may end anywhere.
+        held (iterable): Pairs of ions that ran an MS gate on the tick before
+            the window, and so have to stay put on the first tick.
+        movable (iterable): Other ions allowed to move, for example to make
+            way or to rest on an idle node.
+        objective (str): "ticks" for the shortest plan, "temperature" for the
+            lowest heating summed over all ions.
+        max_ticks (int): Longest plan considered.
+        max_expansions (int): Search budget.
+
+    Returns:
+        tuple: The positions history and the gates schedule of the window.
+        The first tick is at `start_positions`, the last one at `end_positions`
+        with no MS gate running.
+
+    Raises:
+        ValueError: If no plan exists within the limits.
+    """
+    if objective not in ("ticks", "temperature"):
+        raise ValueError(f"Unknown objective: {objective}")
+    num_ions = len(start_positions)
+    held = {tuple(sorted(pair)) for pair in held}
+
+    wires = [set() for _ in range(num_ions)]
+    for g, gate in enumerate(gates):
+        for ion in gate[2] if gate[0] == "MS" else (gate[2],):
+            wires[ion].add(g)
+    active = [
+        ion
+        for ion in range(num_ions)
+        if wires[ion]
+        or (end_positions is not None and end_positions[ion] != start_positions[ion])
+        or any(ion in pair for pair in held)
+        or ion in set(movable)
+    ]
+    index = {ion: a for a, ion in enumerate(active)}
+    fixed = [start_positions[ion] for ion in range(num_ions) if ion not in index]
+    sequences = [sorted(wires[ion]) for ion in active]
+    held = {(index[i], index[j]) for i, j in held}
+
+    zones = interaction_nodes(graph)
+    to_zone = nx.multi_source_dijkstra_path_length(graph, zones)
+    to_end = [
+        nx.single_source_shortest_path_length(graph, end_positions[ion])
+        if end_positions is not None
+        else None
+        for ion in active
+    ]
+    fixed_heat = sum(heating(p, p, graph) for p in fixed)
+    min_heat = fixed_heat + min(HEATING_IDLE, HEATING_STAY, HEATING_MOVE) * len(active)
+
+    fixed_set = set(fixed)
+
+    def blocks(q, taken):
+        """Whether an ion can't be on q when the nodes in taken are occupied."""
+        if q in fixed_set:
+            return True
+        if len(q) == 3:
+            return q[:2] in taken or q[:2] in fixed_set
+        if (*q, "idle") in taken or (*q, "idle") in fixed_set:
+            return True
+        if q in taken:
+            return graph.nodes[q]["type"] != "interaction" or taken.count(q) > 1
+        return False
+
+    def joint_moves(pos, options):
+        """Next positions of the active ions without collisions or swaps."""
+        chosen = []
+
+        def extend(a):
+            if a == len(options):
+                yield tuple(chosen)
+                return
+            for q in options[a]:
+                if blocks(q, chosen):
+                    continue
+                if q != pos[a] and any(
+                    chosen[b] == pos[a] and pos[b] == q for b in range(a)
+                ):
+                    continue
+                chosen.append(q)
+                yield from extend(a + 1)
+                chosen.pop()
+
+        return extend(0)
+
+    def apply_gates(pos, prog, hold):
+        """Gates run on this tick, or None if the tick is not allowed."""
+        occupied = pos + tuple(fixed)
+        pairs = _colocated_pairs(occupied)
+        if pairs is None:
+            return None
+        for p in occupied:
+            if len(p) == 3 and p[:2] in occupied:
+                return None
+        prog = list(prog)
+        ms = []
+        for i, j in pairs:
+            if j >= len(active) or graph.nodes[pos[i]]["type"] != "interaction":
+                return None
+            if (i, j) in hold:
+                continue
+            gi = sequences[i][prog[i]] if prog[i] < len(sequences[i]) else None
+            gj = sequences[j][prog[j]] if prog[j] < len(sequences[j]) else None
+            if gi is None or gi != gj:
+                return None
+            prog[i] += 1
+            prog[j] += 1
+            ms.append((i, j))
+        ran = [gates[sequences[i][prog[i] - 1]] for i, _ in ms]
+        for a in range(len(active)):
+            if a in (k for pair in ms for k in pair) or prog[a] >= len(sequences[a]):
+                continue
+            gate = gates[sequences[a][prog[a]]]
+            if gate[0] != "MS" and graph.nodes[pos[a]]["type"] == "standard":
+                prog[a] += 1
+                ran.append(gate)
+        return tuple(prog), ran, ms
+
+    def lower_bound(pos, prog, hold):
+        """Admissible estimate of the ticks left until the last tick."""
+        bound = 0
+        held_ions = {k for pair in hold for k in pair}
+        for a in range(len(active)):
+            h = 1 if a in held_ions else 0
+            remaining = [gates[g] for g in sequences[a][prog[a]:]]
+            k_ms = sum(1 for gate in remaining if gate[0] == "MS")
+            k_single = len(remaining) - k_ms
+            bound = max(bound, h, h + k_single + 2 * k_ms - 1)
+            if k_ms:
+                bound = max(bound, h + to_zone.get(pos[a], float("inf")) + 2 * k_ms)
+            if to_end[a] is not None:
+                bound = max(bound, to_end[a].get(pos[a], float("inf")))
+        return bound if objective == "ticks" else bound * min_heat
+
+    start = (
+        tuple(start_positions[ion] for ion in active),
+        tuple(0 for _ in active),
+        tuple(sorted(held)),
+    )
+    best = {start: 0}
+    came_from = {start: None}
+    tie = itertools.count()
+    heap = [(lower_bound(*start), next(tie), 0, 0, start)]
+    expansions = 0
+
+    while heap:
+        _, _, cost, tick, state = heapq.heappop(heap)
+        if cost > best.get(state, float("inf")):
+            continue
+        expansions += 1
+        profiling.count("solve_window.expansions")
+        if expansions > max_expansions:
+            raise ValueError("Search budget exceeded.")
+
+        pos, prog, hold = state
+        applied = apply_gates(pos, prog, set(hold))
+        if applied is None:
+            continue
+        new_prog, ran, ms = applied
+
+        if (
+            all(p == len(s) for p, s in zip(new_prog, sequences))
+            and not ms
+            and not hold
+            and (end_positions is None or all(pos[a] == end_positions[ion] for a, ion in enumerate(active)))
+        ):
+            return _reconstruct(state, came_from, active, start_positions, apply_gates)
+        if tick + 1 >= max_ticks:
+            continue
+
+        ms_ions = {k for pair in ms for k in pair}
+        options = [
+            [pos[a]] if a in ms_ions else [pos[a], *graph.neighbors(pos[a])]
+            for a in range(len(active))
+        ]
+        for nxt in joint_moves(pos, options):
+            step_cost = 1 if objective == "ticks" else fixed_heat + sum(
+                heating(p, q, graph) for p, q in zip(pos, nxt)
+            )
+            child = (tuple(nxt), new_prog, tuple(sorted(ms)))
+            child_cost = cost + step_cost
+            if child_cost < best.get(child, float("inf")) - 1e-12:
+                best[child] = child_cost
+                came_from[child] = state
+                heapq.heappush(
+                    heap,
+                    (child_cost + lower_bound(*child), next(tie), child_cost, tick + 1, child),
+                )
+
+    raise ValueError(f"No plan within {max_ticks} ticks.")
+
+
+def _reconstruct(state, came_from, active, start_positions, apply_gates):
+    states = []
+    while state is not None:
+        states.append(state)
+        state = came_from[state]
+    states.reverse()
+
+    positions_history = []
+    gates_schedule = []
+    for pos, prog, hold in states:
+        positions = list(start_positions)
+        for a, ion in enumerate(active):
+            positions[ion] = pos[a]
+        positions_history.append(positions)
+        gates_schedule.append(apply_gates(pos, prog, set(hold))[1])
+    return positions_history, gates_schedule
+
+
+def window_heating(positions_history, graph):
+    """Heating summed over all ions and all ticks after the first one."""
+    return sum(
+        heating(p, q, graph)
+        for prev, curr in zip(positions_history, positions_history[1:])
+        for p, q in zip(prev, curr)
+    )
+
+
+def optimize_window(positions_history, gates_schedule, graph, start, stop, objective="ticks", **limits):
+    """
+    Replace the ticks [start, stop) of a schedule by an optimal plan.
+
+    The window keeps the positions of its first and last tick, so the rest of
+    the schedule is untouched. The last tick of the window must not run an MS
+    gate nor have two ions on the same node.
+
+    Args:
+        positions_history (list): A list of positions for each step in the circuit.
+        gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        graph (nx.Graph): The graph representing the Penning trap.
+        start (int): First tick of the window.
+        stop (int): Tick after the last tick of the window.
+        objective (str): "ticks" or "temperature", see `solve_window`.
+        **limits: `max_ticks` and `max_expansions` passed to `solve_window`.
+
+    Returns:
+        tuple: The positions history and gates schedule, with the window
+        replaced if the optimal plan is better, and a dict comparing the window
+        before and after.
+    """
+    last = stop - 1
+    if any(gate[0] == "MS" for gate in gates_schedule[last]):
+        raise ValueError(f"An MS gate runs on the last tick {last} of the window.")
+    if len(set(positions_history[last])) < len(positions_history[last]):
+        raise ValueError(f"Ions share a node on the last tick {last} of the window.")
+
+    held = []
+    if start > 0:
+        held = [
+            gate[2]
+            for gate in gates_schedule[start - 1]
+            if gate[0] == "MS"
+        ]
+    gates = [gate for step in gates_schedule[start:stop] for gate in step]
+    window = positions_history[start:stop]
+
+    new_positions, new_gates = solve_window(
+        graph,
+        positions_history[start],
+        gates,
+        end_positions=positions_history[last],
+        held=held,
+        objective=objective,
+        **limits,
+    )
+    report = {
+        "ticks_before": len(window),
+        "ticks_after": len(new_positions),
+        "heating_before": window_heating(window, graph),
+        "heating_after": window_heating(new_positions, graph),
+    }
+    key = "ticks" if objective == "ticks" else "heating"
+    improved = report[f"{key}_after"] < report[f"{key}_before"] - 1e-12
+    report["replaced"] = improved
+    if not improved:
+        return positions_history, gates_schedule, report
+    return (
+        positions_history[:start] + new_positions + positions_history[stop:],
+        gates_schedule[:start] + new_gates + gates_schedule[stop:],
+        report,
+    )
+
+
+def window_boundaries(positions_history, gates_schedule):
+    """Ticks that can end a window: no MS gate and no two ions on one node."""
+    return [
+        t
+        for t in range(len(positions_history))
+        if not any(gate[0] == "MS" for gate in gates_schedule[t])
+        and len(set(positions_history[t])) == len(positions_history[t])
+    ]
+
+
+@profiling.timed("improve_schedule")
+def improve_schedule(
+    positions_history,
+    gates_schedule,
+    graph,
+    max_ms=2,
+    max_active=4,
+    max_window=12,
+    objective="ticks",
+    **limits,
+):
+    """
+    Optimize a full schedule window by window.
+
+    Windows run from one boundary tick to the next one so that they span at
+    most `max_window` ticks, hold at most `max_ms` MS gates and at most
+    `max_active` ions move or run gates. Windows exceeding the search budget
+    are left as they are.
+
+    Args:
+        positions_history (list): A list of positions for each step in the circuit.
+        gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        graph (nx.Graph): The graph representing the Penning trap.
+        max_ms (int): Largest number of MS gates in a window.
+        max_active (int): Largest number of ions taking part in a window.
+        max_window (int): Largest number of ticks in a window.
+        objective (str): "ticks" or "temperature", see `solve_window`.
+        **limits: `max_ticks` and `max_expansions` passed to `solve_window`.
+
+    Returns:
+        tuple: The improved positions history and gates schedule, and the list
+        of reports of the windows that were solved.
+    """
+    reports = []
+    start = 0
+    while start < len(positions_history) - 1:
+        best_stop = None
+        for stop in window_boundaries(positions_history, gates_schedule):
+            if stop <= start:
+                continue
+            if stop - start >= max_window:
+                break
+            window_gates = [g for step in gates_schedule[start:stop + 1] for g in step]
+            moving = {
+                ion
+                for t in range(start, stop)
+                for ion, (p, q) in enumerate(zip(positions_history[t], positions_history[t + 1]))
+                if p != q
+            }
+            ions = moving | {
+                ion for g in window_gates for ion in (g[2] if g[0] == "MS" else (g[2],))
+            }
+            if sum(g[0] == "MS" for g in window_gates) > max_ms or len(ions) > max_active:
+                break
+            best_stop = stop + 1
+        if best_stop is None:
+            start += 1
+            continue
+        try:
+            positions_history, gates_schedule, report = optimize_window(
+                positions_history, gates_schedule, graph, start, best_stop, objective, **limits
+            )
+        except ValueError:
+            start = best_stop - 1
+            continue
+        report["start"] = start
+        reports.append(report)
+        start += max(1, report["ticks_after" if report["replaced"] else "ticks_before"] - 1)
+    return positions_history, gates_schedule, reports
+
+
+if __name__ == "__main__":
+    from transpile_qiskit import layers
+    from router import route, route_pipelined
+    from trap import create_trap_graph
+    from verifier import verify_structure
+
+    graph = create_trap_graph()
+    for name, compiler in [("baseline", route), ("pipelined", route_pipelined)]:
+        positions_history, gates_schedule = compiler(layers, graph)
+        improved = improve_schedule(positions_history, gates_schedule, graph, max_expansions=5000)
+        verify_structure(improved[0], improved[1], graph)
+        windows = improved[2]
+        print(
+            f"{name}: {len(positions_history)} -> {len(improved[0])} ticks, "
+            f"{sum(r['replaced'] for r in windows)} of {len(windows)} windows improved"
+        )
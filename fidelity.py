@@ -1,6 +1,17 @@
 import pennylane as qml
 import numpy as np
 
+import profiling
+from noise_model import (
+    ETA,
+    HEATING_IDLE,
+    HEATING_MOVE,
+    HEATING_STAY,
+    eps,
+    get_temperatures,
+    ms_error_probability,
+)
+
 mixed_device = qml.device("default.mixed", wires=8)
 
 
@@ -10,40 +21,10 @@ def circuit():
     return qml.density_matrix(wires=range(8))
 
 
-def get_temperatures(positions_history, graph):
-    """
-    Calculate the temperature of each ion based on its positions history and the graph.
-
-    Args:
-        positions_history (list): A list of positions of the ions.
-        graph (nx.Graph): The graph representing the circuit.
-
-    Returns:
-        list: A list of temperatures for each ion.
-    """
-    temperature = [[0.0] * len(positions_history[0])]
-    for i, pos in enumerate(positions_history):
-        temp = temperature[-1].copy()
-        for j, p in enumerate(pos):
-            if i > 0:
-                if p == positions_history[i - 1][j]:
-                    if graph.nodes[p]["type"] == "idle":
-                        temp[j] += 0.01
-                    else:
-                        temp[j] += 0.02
-                else:
-                    temp[j] += 0.03
-        temperature.append(temp)
-    temperature.pop(0)
-    return temperature
-
-
 # Create noisy circuit
 
 from pennylane.operation import Channel
 
-eps = eps = 1e-14
-
 
 class DepolarizingChannel(Channel):
     num_params = 1
@@ -55,6 +36,7 @@ class DepolarizingChannel(Channel):
         super().__init__(p, wires=wires, id=id)
 
     @staticmethod
+    @profiling.timed("DepolarizingChannel.compute_kraus_matrices")
     def compute_kraus_matrices(p):  # pylint:disable=arguments-differ
         r"""Kraus matrices representing the depolarizing channel."""
         if not 0.0 <= p <= 1.0:
@@ -103,19 +85,20 @@ class DepolarizingChannel(Channel):
         ]
 
 
-def compiled_circuit_noisy(gates_schedule, temperature) -> qml.QNode:
+@profiling.timed("fidelity.compiled_circuit_noisy")
+def compiled_circuit_noisy(gates_schedule, temperature, eta=ETA) -> qml.QNode:
     """
     Build a noisy circuit from the list of gates and the ion temperatures.
 
     Args:
         gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        temperature (list): The temperatures of the ions at each step.
+        eta (float): Lamb-Dicke parameter of the MS gates.
 
     Returns:
         qml.QNode: A Pennylane QNode representing the circuit.
     """
-    dev = qml.device("default.mixed", wires=8)
-
-    @qml.qnode(dev)
+    @qml.qnode(mixed_device)
     def circuit():
         for i, step in enumerate(gates_schedule):
             temp = temperature[i]
@@ -128,12 +111,7 @@ def compiled_circuit_noisy(gates_schedule, temperature) -> qml.QNode:
                     temp1 = temp[gate[2][0]]
                     temp2 = temp[gate[2][1]]
                     average_temp = (temp1 + temp2) / 2
-                    prob = (
-                        (np.pi**2 * (0.05) ** 4)
-                        / 4
-                        * average_temp
-                        * (2 * average_temp + 1)
-                    )
+                    prob = ms_error_probability(average_temp, eta)
                     assert 0.0 <= prob <= 1.0, (
                         f"Average temperature too high: ion {gate[2][0]}: {temp1}, ion {gate[2][1]}: {temp2}"
                     )
@@ -144,21 +122,35 @@ def compiled_circuit_noisy(gates_schedule, temperature) -> qml.QNode:
     return circuit
 
 
-def fidelity(positions_history, gates_schedule, graph) -> float:
+def fidelity(
+    positions_history,
+    gates_schedule,
+    graph,
+    expected_result=None,
+    eta=ETA,
+    heating=(HEATING_IDLE, HEATING_STAY, HEATING_MOVE),
+) -> float:
     """
     Fidelity between the ideal and noisy circuit.
 
     Args:
         positions_history (list): A list of positions of the ions.
         gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        expected_result (np.ndarray): Density matrix of the ideal circuit, if
+            already computed. Defaults to running `circuit`.
+        eta (float): Lamb-Dicke parameter of the MS gates.
+        heating (tuple): Idle, stay and move heating per tick, see `get_temperatures`.
 
     Returns:
         float: The fidelity of the circuit.
     """
-    expected_result = circuit()
-    noisy_user_result = compiled_circuit_noisy(
-        gates_schedule, get_temperatures(positions_history, graph)
-    )()
+    if expected_result is None:
+        expected_result = circuit()
+    qnode = compiled_circuit_noisy(
+        gates_schedule, get_temperatures(positions_history, graph, *heating), eta
+    )
+    with profiling.timer("fidelity.simulate"):
+        noisy_user_result = qnode()
     noisy_user_fidelity = qml.math.fidelity(expected_result, noisy_user_result)
     print("Fidelity of the circuit when including noise:", noisy_user_fidelity)
     return noisy_user_fidelity
@@ -6,6 +6,8 @@ from qiskit.circuit.library import CRZGate
 import numpy as np
 from qiskit.converters import circuit_to_dag
 
+import profiling
+
 # Create a circuit with a CRZ gate
 qc = QuantumCircuit(8)
 for i in range(8):
@@ -79,6 +81,7 @@ class GatesScheduleTicks():
         self.add_tick()
 
 
+    @profiling.timed("GatesScheduleTicks.gen")
     def gen(self, gates_in):
 
         # buttom_in = 0
@@ -109,6 +112,7 @@ class GatesScheduleTicks():
                 else:
                     raise ValueError("Unexpected gate tyep" + gates_in[scan_in][0] + ".")
                 scan_in += 1
+            profiling.count("GatesScheduleTicks.gen.scans", scan_in)
 
             print(self.tick.gates)
             self.add_tick()
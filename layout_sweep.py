@@ -0,0 +1,158 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from tabulate import tabulate
+
+from fidelity import fidelity, get_temperatures
+from router import route_pipelined
+from trap import ROWS, COLS, INTERACTION_NODES, create_trap_graph, generate_interaction_patterns
+from verifier import verify_equivalence, verify_structure
+
+
+def candidate_layouts(rows=ROWS, cols=COLS, **patterns):
+    """
+    List the candidate layouts of a grid.
+
+    Args:
+        rows (int): Number of rows of the grid.
+        cols (int): Number of columns of the grid.
+        **patterns: Extra arguments passed to `generate_interaction_patterns`.
+
+    Returns:
+        list: Layouts as dicts of `create_trap_graph` arguments.
+    """
+    return [
+        {"rows": rows, "cols": cols, "interaction_nodes": nodes}
+        for nodes in generate_interaction_patterns(rows, cols, **patterns)
+    ]
+
+
+def circuit_inputs(qc):
+    """
+    Transpile a circuit for the sweep.
+
+    Args:
+        qc (QuantumCircuit): The circuit.
+
+    Returns:
+        tuple: The gate layers of the circuit and its reference density matrix.
+    """
+    from transpile_qiskit import (
+        circuit_layers,
+        prepare_circuit,
+        reference_density_matrix,
+        transpile_native,
+    )
+
+    prepared = prepare_circuit(qc)
+    return circuit_layers(transpile_native(prepared)), reference_density_matrix(prepared)
+
+
+def evaluate_layout(name, layers, expected_result, layout, compiler=route_pipelined):
+    """
+    Compile a circuit on one layout, verify it and measure the result.
+
+    Args:
+        name (str): Name of the circuit.
+        layers (list): The gate layers of the circuit.
+        expected_result (np.ndarray): Density matrix of the ideal circuit, see
+            `circuit_inputs`.
+        layout (dict): Arguments passed to `create_trap_graph`, with the same
+            defaults.
+        compiler (callable): Function turning (layers, graph) into a positions
+            history and a gates schedule.
+
+    Returns:
+        dict: Schedule length, peak temperature, fidelity and compile time, or
+        the error that stopped the evaluation.
+    """
+    layout = {"rows": ROWS, "cols": COLS, **layout}
+    if layout.get("interaction_nodes") is None:
+        layout["interaction_nodes"] = INTERACTION_NODES
+    result = {"circuit": name, **layout}
+    try:
+        result["zones"] = len(layout["interaction_nodes"])
+        graph = create_trap_graph(**layout)
+        start = time.perf_counter()
+        positions_history, gates_schedule = compiler(layers, graph)
+        result["compile_time"] = time.perf_counter() - start
+        verify_structure(positions_history, gates_schedule, graph)
+        verify_equivalence(gates_schedule, expected_result)
+        temperatures = get_temperatures(positions_history, graph)
+        result["ticks"] = len(positions_history)
+        result["peak_temperature"] = max(max(t) for t in temperatures)
+        result["fidelity"] = float(
+            fidelity(positions_history, gates_schedule, graph, expected_result=expected_result)
+        )
+    except Exception as e:  # a bad layout must not take the rest of the sweep down
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def sweep_layouts(circuits, layouts, compiler=route_pipelined, max_workers=None):
+    """
+    Compile every circuit on every layout in parallel.
+
+    Each circuit is transpiled once, here, and scored against its own reference
+    density matrix.
+
+    Args:
+        circuits (dict): Qiskit circuits, keyed by name.
+        layouts (list): Layouts as dicts of `create_trap_graph` arguments.
+        compiler (callable): Function turning (layers, graph) into a positions
+            history and a gates schedule. Must be picklable.
+        max_workers (int): Number of worker processes. With 1, the layouts
+            are evaluated in this process, which keeps them visible to `profiling`.
+
+    Returns:
+        list: One result dict per circuit and layout, see `evaluate_layout`.
+    """
+    inputs = {name: circuit_inputs(qc) for name, qc in circuits.items()}
+    jobs = [
+        (name, layers, expected_result, layout)
+        for name, (layers, expected_result) in inputs.items()
+        for layout in layouts
+    ]
+    if max_workers == 1:
+        return [evaluate_layout(*job, compiler) for job in jobs]
+    # Forked workers hang in Qiskit's thread pool once this process has transpiled.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = [executor.submit(evaluate_layout, *job, compiler) for job in jobs]
+        return [f.result() for f in futures]
+
+
+def format_report(results):
+    """
+    Format sweep results as a table, best fidelity first.
+
+    Args:
+        results (list): Result dicts returned by `sweep_layouts`.
+
+    Returns:
+        str: The table.
+    """
+    headers = ["circuit", "grid", "zones", "interaction nodes", "ticks",
+               "peak temp", "fidelity", "compile [s]", "error"]
+    rows = []
+    for r in sorted(results, key=lambda r: (r["circuit"], -r.get("fidelity", -1))):
+        rows.append([
+            r["circuit"],
+            f"{r['rows']}x{r['cols']}",
+            r.get("zones"),
+            r.get("interaction_nodes"),
+            r.get("ticks"),
+            r.get("peak_temperature"),
+            r.get("fidelity"),
+            r.get("compile_time"),
+            r.get("error", ""),
+        ])
+    return tabulate(rows, headers=headers, floatfmt=".4f")
+
+
+if __name__ == "__main__":
+    from transpile_qiskit import qft_circuit
+
+    results = sweep_layouts({"QFT(8)": qft_circuit()}, candidate_layouts(min_zones=2))
+    print(format_report(results))
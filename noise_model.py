@@ -0,0 +1,76 @@
+"""
+Noise model of the trap: how ions heat up, and how their temperature turns into
+MS gate errors.
+
+Kept free of PennyLane so that the routers and solvers can score schedules with
+the same constants as `fidelity` without loading the simulator.
+"""
+
+import numpy as np
+
+import profiling
+
+# Noise model: heating of an ion per tick, and the Lamb-Dicke parameter of the MS gates.
+HEATING_IDLE = 0.01
+HEATING_STAY = 0.02
+HEATING_MOVE = 0.03
+ETA = 0.05
+# Added to the weights of the depolarizing channel, which keeps its Kraus matrices nonzero.
+eps = 1e-14
+
+
+def heating(prev, curr, graph):
+    """Temperature increase of one ion over one tick, as in `get_temperatures`."""
+    if prev != curr:
+        return HEATING_MOVE
+    if graph.nodes[curr]["type"] == "idle":
+        return HEATING_IDLE
+    return HEATING_STAY
+
+
+@profiling.timed("get_temperatures")
+def get_temperatures(
+    positions_history, graph, idle=HEATING_IDLE, stay=HEATING_STAY, move=HEATING_MOVE
+):
+    """
+    Calculate the temperature of each ion based on its positions history and the graph.
+
+    Args:
+        positions_history (list): A list of positions of the ions.
+        graph (nx.Graph): The graph representing the circuit.
+        idle (float): Heating of an ion staying on an idle node for one tick.
+        stay (float): Heating of an ion staying on any other node for one tick.
+        move (float): Heating of an ion moving along an edge.
+
+    Returns:
+        list: A list of temperatures for each ion.
+    """
+    temperature = [[0.0] * len(positions_history[0])]
+    for i, pos in enumerate(positions_history):
+        temp = temperature[-1].copy()
+        for j, p in enumerate(pos):
+            if i > 0:
+                if p == positions_history[i - 1][j]:
+                    if graph.nodes[p]["type"] == "idle":
+                        temp[j] += idle
+                    else:
+                        temp[j] += stay
+                else:
+                    temp[j] += move
+        temperature.append(temp)
+    temperature.pop(0)
+    return temperature
+
+
+def ms_error_probability(average_temp, eta=ETA):
+    """
+    Depolarizing probability of an MS gate.
+
+    Args:
+        average_temp: Average temperature of the two ions, a float or an array.
+        eta: Lamb-Dicke parameter, a float or an array broadcasting with `average_temp`.
+
+    Returns:
+        The probability, with the broadcast shape of the arguments.
+    """
+    return (np.pi**2 * eta**4) / 4 * average_temp * (2 * average_temp + 1)
@@ -0,0 +1,220 @@
+"""
+Noise parameter sweeps.
+
+`fidelity.fidelity` simulates a schedule for one value of the Lamb-Dicke
+parameter and of the heating costs. Calibration drifts, so `fidelity_surface`
+evaluates one schedule over a whole grid of them in a single batched density
+matrix simulation:
+
+- the temperatures are linear in the heating costs, so the positions history is
+  reduced once to per-ion counts of idle, stay and move ticks,
+- the depolarizing probability of every MS gate is computed for the whole grid
+  at once,
+- the gates are applied to a stack of density matrices, one per grid point, and
+  the state before the first MS gate is simulated only once.
+"""
+
+import numpy as np
+
+import profiling
+from noise_model import ETA, HEATING_IDLE, HEATING_MOVE, HEATING_STAY, eps, ms_error_probability
+
+NUM_QUBITS = 8
+_ROWS = "abcdefgh"
+_COLS = "ijklmnop"
+
+
+def heating_counts(positions_history, graph):
+    """
+    Count the idle, stay and move ticks of each ion up to each step.
+
+    Args:
+        positions_history (list): A list of positions of the ions.
+        graph (nx.Graph): The graph representing the trap.
+
+    Returns:
+        np.ndarray: Counts of shape (steps, ions, 3).
+    """
+    counts = np.zeros((len(positions_history), len(positions_history[0]), 3))
+    for i in range(1, len(positions_history)):
+        for j, p in enumerate(positions_history[i]):
+            if p != positions_history[i - 1][j]:
+                counts[i, j, 2] = 1
+            elif graph.nodes[p]["type"] == "idle":
+                counts[i, j, 0] = 1
+            else:
+                counts[i, j, 1] = 1
+    return np.cumsum(counts, axis=0)
+
+
+def scaled_heating_costs(scales):
+    """Heating costs (idle, stay, move) of the default model scaled by each factor."""
+    return [
+        (s * HEATING_IDLE, s * HEATING_STAY, s * HEATING_MOVE) for s in scales
+    ]
+
+
+def _rotation(name, theta):
+    c, s = np.cos(theta / 2), np.sin(theta / 2)
+    if name == "RX":
+        return np.array([[c, -1j * s], [-1j * s, c]])
+    if name == "RY":
+        return np.array([[c, -s], [s, c]], dtype=complex)
+    # MS, as `qml.IsingXX`.
+    xx = np.fliplr(np.eye(4))
+    return c * np.eye(4) - 1j * s * xx
+
+
+def _apply_unitary(rho, matrix, wires):
+    """Apply U rho U^dagger on the given wires of a stack of density matrices."""
+    k = len(wires)
+    u = matrix.reshape((2,) * 2 * k)
+    for axes, op in (([1 + w for w in wires], u), ([1 + NUM_QUBITS + w for w in wires], u.conj())):
+        rho = np.tensordot(rho, op, axes=(axes, list(range(k, 2 * k))))
+        rho = np.moveaxis(rho, list(range(-k, 0)), axes)
+    return rho
+
+
+def _depolarize(rho, p, wires):
+    """
+    Apply `fidelity.DepolarizingChannel` to a stack of density matrices.
+
+    Summed over all 16 two-qubit Paulis, P rho P is 4 I x Tr_wires(rho), so the
+    channel only needs one partial trace.
+    """
+    a, b = wires
+    rows, cols = list(_ROWS), list(_COLS)
+    rows[a] = cols[a] = "q"
+    rows[b] = cols[b] = "r"
+    mixed = np.einsum(
+        f"z{''.join(rows)}{''.join(cols)},{_ROWS[a]}{_COLS[a]},{_ROWS[b]}{_COLS[b]}->z{_ROWS}{_COLS}",
+        rho,
+        np.eye(2),
+        np.eye(2),
+    )
+    p = p.reshape((-1,) + (1,) * 2 * NUM_QUBITS)
+    return (1 - p + eps) * rho + (p / 15 + eps) * (4 * mixed - rho)
+
+
+@profiling.timed("simulate_batch")
+def simulate_batch(gates_schedule, probabilities):
+    """
+    Simulate a gates schedule for a batch of MS error probabilities.
+
+    Args:
+        gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        probabilities (np.ndarray): Depolarizing probability of each MS gate, in
+            schedule order, for each batch element; shape (batch, MS gates).
+
+    Returns:
+        np.ndarray: Density matrices of shape (batch, 256, 256).
+    """
+    dim = 2**NUM_QUBITS
+    rho = np.zeros((1,) + (2,) * 2 * NUM_QUBITS, dtype=complex)
+    rho[(0,) * (1 + 2 * NUM_QUBITS)] = 1
+    k = 0
+    for step in gates_schedule:
+        for name, param, wires in step:
+            wires = tuple(wires) if name == "MS" else (wires,)
+            rho = _apply_unitary(rho, _rotation(name, param), wires)
+            if name == "MS":
+                # The first noisy gate broadcasts the shared state to the whole batch.
+                rho = _depolarize(rho, probabilities[:, k], wires)
+                k += 1
+    return np.broadcast_to(rho, (len(probabilities),) + rho.shape[1:]).reshape(-1, dim, dim)
+
+
+@profiling.timed("batch_fidelity")
+def batch_fidelity(expected_result, states):
+    """
+    Fidelity of each state of a stack with the expected density matrix, as in
+    `qml.math.fidelity`.
+
+    Args:
+        expected_result (np.ndarray): Density matrix of the ideal circuit.
+        states (np.ndarray): Density matrices of shape (batch, dim, dim).
+
+    Returns:
+        np.ndarray: The fidelities, of shape (batch,).
+    """
+    w, v = np.linalg.eigh(expected_result)
+    sqrt_expected = (v * np.sqrt(np.clip(w, 0, None))) @ v.conj().T
+    eigenvalues = np.linalg.eigvalsh(sqrt_expected @ states @ sqrt_expected)
+    return np.sum(np.sqrt(np.clip(eigenvalues, 0, None)), axis=-1) ** 2
+
+
+def fidelity_surface(
+    positions_history,
+    gates_schedule,
+    graph,
+    etas=(ETA,),
+    heating_costs=((HEATING_IDLE, HEATING_STAY, HEATING_MOVE),),
+    expected_result=None,
+    batch_size=32,
+):
+    """
+    Fidelity of one schedule over a grid of noise parameters.
+
+    Args:
+        positions_history (list): A list of positions of the ions.
+        gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        graph (nx.Graph): The graph representing the trap.
+        etas (list): Lamb-Dicke parameters.
+        heating_costs (list): Heating costs as (idle, stay, move) triples, see
+            `noise_model.get_temperatures` and `scaled_heating_costs`.
+        expected_result (np.ndarray): Density matrix of the ideal circuit.
+            Defaults to running `fidelity.circuit`, the QFT(8).
+        batch_size (int): Number of grid points simulated together, which
+            bounds the memory used (1 MB per grid point).
+
+    Returns:
+        np.ndarray: Fidelities of shape (len(etas), len(heating_costs)). Grid
+        points where an MS probability exceeds 1 are NaN.
+    """
+    if expected_result is None:
+        from fidelity import circuit
+
+        expected_result = circuit()
+    etas = np.asarray(etas, dtype=float)
+    costs = np.asarray(heating_costs, dtype=float)
+
+    # Temperatures of shape (heating costs, steps, ions).
+    temperatures = np.einsum("sic,hc->hsi", heating_counts(positions_history, graph), costs)
+    ms_gates = [
+        (i, wires) for i, step in enumerate(gates_schedule) for name, _, wires in step if name == "MS"
+    ]
+    average = np.zeros((len(costs), len(ms_gates)))
+    for k, (i, (a, b)) in enumerate(ms_gates):
+        average[:, k] = (temperatures[:, i, a] + temperatures[:, i, b]) / 2
+    probabilities = ms_error_probability(average[None], etas[:, None, None])
+    probabilities = probabilities.reshape(len(etas) * len(costs), len(ms_gates))
+
+    surface = np.empty(len(probabilities))
+    for start in range(0, len(probabilities), batch_size):
+        chunk = probabilities[start:start + batch_size]
+        surface[start:start + batch_size] = batch_fidelity(
+            expected_result, simulate_batch(gates_schedule, chunk)
+        )
+    surface[(probabilities > 1).any(axis=1)] = np.nan
+    return surface.reshape(len(etas), len(costs))
+
+
+if __name__ == "__main__":
+    from tabulate import tabulate
+
+    from router import route_pipelined
+    from transpile_qiskit import layers
+    from trap import create_trap_graph
+
+    graph = create_trap_graph()
+    positions_history, gates_schedule = route_pipelined(layers, graph)
+    etas = [0.03, 0.04, 0.05, 0.06, 0.07]
+    scales = [0.5, 1.0, 1.5, 2.0, 4.0]
+    surface = fidelity_surface(
+        positions_history, gates_schedule, graph, etas, scaled_heating_costs(scales)
+    )
+    print(tabulate(
+        [[eta, *row] for eta, row in zip(etas, surface)],
+        headers=["eta \\ heating"] + [f"x{s}" for s in scales],
+        floatfmt=".4f",
+    ))
@@ -0,0 +1,286 @@
+"""
+Opt-in profiling hooks.
+
+The hot paths of the compiler, simulators and verifier are wrapped in named
+timers and counters. They are off by default, and then cost one flag check per
+call. Turn them on around a run and read the results:
+
+    import profiling
+
+    with profiling.profiled(sample_interval=0.005):
+        compile_file("circuits/qft8.qasm")
+    print(profiling.summary())
+    profiling.write_collapsed("timers.folded")
+    profiling.write_collapsed("samples.folded", source="samples")
+
+The .folded files are in the collapsed stack format read by flamegraph.pl and
+speedscope. Only the current process is measured, so run parallel tools with a
+single worker when profiling them.
+
+Or from the command line, for any script:
+
+    python profiling.py [--sample 0.005] [--flamegraph out.folded] batch_compile.py circuits/ --workers 1
+"""
+
+import argparse
+import contextlib
+import functools
+import os
+import runpy
+import sys
+import threading
+import time
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()
+_null_timer = contextlib.nullcontext()
+
+# Calls and inclusive time of each timer, keyed by its stack of timer names.
+timings = {}
+counters = {}
+# Number of samples of each call stack, root first.
+samples = {}
+
+
+def enable():
+    """Turn the timers and counters on."""
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    """Turn the timers and counters off, keeping what was recorded."""
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    """Forget everything recorded so far."""
+    with _lock:
+        timings.clear()
+        counters.clear()
+        samples.clear()
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+class _Timer:
+    __slots__ = ("name", "path", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = _stack()
+        stack.append(self.name)
+        self.path = tuple(stack)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        _stack().pop()
+        with _lock:
+            entry = timings.setdefault(self.path, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+        return False
+
+
+def timer(name):
+    """
+    Context manager timing a block under `name`.
+
+    Args:
+        name (str): Name of the timer.
+
+    Returns:
+        A context manager, which does nothing while profiling is off.
+    """
+    if not _enabled:
+        return _null_timer
+    return _Timer(name)
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of a function.
+
+    Args:
+        name (str): Name of the timer. Defaults to the qualified name of the function.
+    """
+
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Timer(label):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, n=1):
+    """Add `n` to the counter `name` if profiling is on."""
+    if _enabled:
+        with _lock:
+            counters[name] = counters.get(name, 0) + n
+
+
+def _frame_stack(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        frame_name = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        # Spaces separate the stack from its weight in the collapsed format.
+        stack.append(frame_name.replace(" ", "_"))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+@contextlib.contextmanager
+def sampling(interval=0.005, thread=None):
+    """
+    Sample the call stack of a thread at a fixed interval while the block runs.
+
+    Args:
+        interval (float): Seconds between samples.
+        thread (threading.Thread): Thread to sample. Defaults to the current one.
+    """
+    target = (thread or threading.current_thread()).ident
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                continue
+            stack = _frame_stack(frame)
+            with _lock:
+                samples[stack] = samples.get(stack, 0) + 1
+
+    sampler = threading.Thread(target=run, name="profiling-sampler", daemon=True)
+    sampler.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        sampler.join()
+
+
+@contextlib.contextmanager
+def profiled(sample_interval=None):
+    """
+    Record a fresh profile of the block.
+
+    Args:
+        sample_interval (float): Also sample the call stack at this interval,
+            in seconds. No sampling if None.
+    """
+    reset()
+    enable()
+    try:
+        if sample_interval:
+            with sampling(sample_interval):
+                yield
+        else:
+            yield
+    finally:
+        disable()
+
+
+def collapsed(source="timers"):
+    """
+    The profile in the collapsed stack format, one "frame;frame;frame value" line
+    per stack.
+
+    Args:
+        source (str): "timers" for the self time of each timer stack, in
+            microseconds, or "samples" for the number of samples of each call stack.
+
+    Returns:
+        list: The lines.
+    """
+    with _lock:
+        if source == "samples":
+            weights = dict(samples)
+        elif source == "timers":
+            weights = {path: total for path, (_, total) in timings.items()}
+            for path, (_, total) in timings.items():
+                if len(path) > 1 and path[:-1] in weights:
+                    weights[path[:-1]] -= total
+            weights = {path: round(w * 1e6) for path, w in weights.items()}
+        else:
+            raise ValueError(f"Unknown profile source: {source}")
+    return [f"{';'.join(path)} {w}" for path, w in sorted(weights.items()) if w > 0]
+
+
+def write_collapsed(path, source="timers"):
+    """Write `collapsed(source)` to a file, for flamegraph.pl or speedscope."""
+    with open(path, "w") as f:
+        f.write("\n".join(collapsed(source)) + "\n")
+
+
+def summary():
+    """
+    Format the timers, slowest first, and the counters as tables.
+
+    Returns:
+        str: The tables.
+    """
+    # Imported here: the instrumented modules import this one, and some of
+    # them only need the standard library, NumPy and networkx.
+    from tabulate import tabulate
+
+    with _lock:
+        by_name = {}
+        for path, (calls, total) in timings.items():
+            entry = by_name.setdefault(path[-1], [0, 0.0])
+            entry[0] += calls
+            entry[1] += total
+        rows = [
+            [name, calls, total, 1e3 * total / calls]
+            for name, (calls, total) in sorted(by_name.items(), key=lambda item: -item[1][1])
+        ]
+        counter_rows = sorted(counters.items())
+    table = tabulate(rows, headers=["timer", "calls", "total [s]", "mean [ms]"], floatfmt=".4f")
+    if counter_rows:
+        table += "\n\n" + tabulate(counter_rows, headers=["counter", "count"])
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a script with the profiling hooks on.")
+    parser.add_argument("--sample", type=float, default=None, metavar="INTERVAL",
+                        help="also sample the call stack every INTERVAL seconds")
+    parser.add_argument("--flamegraph", default=None, metavar="FILE",
+                        help="write the collapsed stacks to FILE, from the samples if sampling")
+    parser.add_argument("script", help="script to run")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="arguments of the script")
+    args = parser.parse_args()
+
+    # The instrumented modules import `profiling`, which is a different module
+    # object from this `__main__`, so drive that one.
+    import profiling
+
+    sys.argv = [args.script] + args.args
+    sys.path[0] = os.path.dirname(os.path.abspath(args.script))
+    with profiling.profiled(args.sample):
+        runpy.run_path(args.script, run_name="__main__")
+    print(profiling.summary(), file=sys.stderr)
+    if args.flamegraph:
+        profiling.write_collapsed(args.flamegraph, "samples" if args.sample else "timers")
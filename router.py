@@ -0,0 +1,384 @@
+import heapq
+
+import networkx as nx
+
+import profiling
+
+
+def interaction_nodes(graph):
+    """
+    List the interaction nodes of the trap.
+
+    Args:
+        graph (nx.Graph): The graph representing the Penning trap.
+
+    Returns:
+        list: The interaction nodes of the graph.
+    """
+    return [n for n, data in graph.nodes(data=True) if data["type"] == "interaction"]
+
+
+def transport_graph(graph, blocked=()):
+    """
+    View of the trap restricted to the nodes an ion can travel through.
+
+    Idle nodes are left out since an ion parked there still blocks its
+    standard node.
+
+    Args:
+        graph (nx.Graph): The graph representing the Penning trap.
+        blocked (set): Nodes occupied by other ions.
+
+    Returns:
+        nx.Graph: A read-only view of the graph.
+    """
+    return nx.subgraph_view(
+        graph,
+        filter_node=lambda n: graph.nodes[n]["type"] != "idle" and n not in blocked,
+    )
+
+
+def default_home_positions(graph, num_ions=8):
+    """
+    Pick a parking spot on a standard node for each ion.
+
+    Spots close to an interaction node are preferred. A spot is only taken if
+    the remaining free nodes stay connected and every parked ion keeps a free
+    neighbour, so that any ion can always reach any interaction node.
+
+    Args:
+        graph (nx.Graph): The graph representing the Penning trap.
+        num_ions (int): Number of ions to place.
+
+    Returns:
+        list: The home position of each ion.
+    """
+    zones = interaction_nodes(graph)
+    if not zones:
+        raise ValueError("The trap has no interaction node.")
+    distance = nx.multi_source_dijkstra_path_length(transport_graph(graph), zones)
+    candidates = sorted(
+        (n for n, data in graph.nodes(data=True) if data["type"] == "standard"),
+        key=lambda n: (distance.get(n, float("inf")), n),
+    )
+
+    homes = []
+    for node in candidates:
+        trial = homes + [node]
+        free = transport_graph(graph, set(trial))
+        if not nx.is_connected(free):
+            continue
+        if all(any(free.has_node(m) for m in graph.neighbors(h)) for h in trial):
+            homes = trial
+        if len(homes) == num_ions:
+            return homes
+    raise ValueError(f"Could not find home positions for {num_ions} ions.")
+
+
+def shortest_path(graph, source, target, blocked=()):
+    """
+    Shortest path between two nodes avoiding the blocked nodes.
+
+    Args:
+        graph (nx.Graph): The graph representing the Penning trap.
+        source (tuple): Start node.
+        target (tuple): End node.
+        blocked (set): Nodes occupied by other ions.
+
+    Returns:
+        list: The nodes of the path, including source and target.
+    """
+    blocked = set(blocked) - {source, target}
+    return nx.shortest_path(transport_graph(graph, blocked), source, target)
+
+
+@profiling.timed("route")
+def route(layers, graph, homes=None):
+    """
+    Turn gate layers into a positions history and a gates schedule.
+
+    This is the baseline router: ions wait on their home positions, single
+    qubit gates of a layer are applied there in one step and the MS gates are
+    executed one after the other. For each MS gate both ions walk, one at a
+    time, to the closest interaction node, perform the gate, and walk back.
+
+    Args:
+        layers (list): A list of layers, each a list of gates.
+        graph (nx.Graph): The graph representing the Penning trap.
+        homes (list): The home position of each ion. Defaults to
+            `default_home_positions`.
+
+    Returns:
+        tuple: The positions history and the gates schedule.
+    """
+    if homes is None:
+        homes = default_home_positions(graph)
+    positions = list(homes)
+    positions_history = []
+    gates_schedule = []
+
+    def step(gates):
+        positions_history.append(list(positions))
+        gates_schedule.append(list(gates))
+
+    def path_to(ion, zone):
+        return shortest_path(graph, homes[ion], zone, set(homes) - {homes[ion]})
+
+    zones = interaction_nodes(graph)
+
+    for layer in layers:
+        single = [gate for gate in layer if gate[0] != "MS"]
+        if single or not positions_history:
+            step(single)
+
+        for gate in layer:
+            if gate[0] != "MS":
+                continue
+            ion_0, ion_1 = gate[2]
+            paths = [(path_to(ion_0, z), path_to(ion_1, z)) for z in zones]
+            path_0, path_1 = min(paths, key=lambda p: len(p[0]) + len(p[1]))
+
+            for node in path_0[1:]:
+                positions[ion_0] = node
+                step([])
+            for node in path_1[1:-1]:
+                positions[ion_1] = node
+                step([])
+            positions[ion_1] = path_1[-1]
+            step([gate])
+            step([])
+            for node in reversed(path_1[:-1]):
+                positions[ion_1] = node
+                step([])
+            for node in reversed(path_0[:-1]):
+                positions[ion_0] = node
+                step([])
+
+    return positions_history, gates_schedule
+
+
+class SpaceTimeRouter:
+    """
+    Plan collision free ion trajectories tick by tick.
+
+    Every ion has a trajectory, the list of its positions from tick 0 on. After
+    the end of its trajectory an ion is parked on its last position. New moves
+    are planned with an A* search over (node, tick) that avoids the already
+    planned trajectories, so several ions can be on their way at once.
+    """
+
+    def __init__(self, graph, homes, horizon=200):
+        self.graph = graph
+        self.homes = list(homes)
+        self.horizon = horizon
+        self.free_graph = transport_graph(graph)
+        self.trajectories = [[home] for home in homes]
+        self.gates = {}
+        self.last_gate = [-1] * len(homes)
+        self._distances = {}
+
+    def position(self, ion, tick):
+        trajectory = self.trajectories[ion]
+        return trajectory[min(tick, len(trajectory) - 1)]
+
+    def end(self, ion):
+        return len(self.trajectories[ion]) - 1
+
+    def wait(self, ion, tick):
+        """Keep the ion on its current position up to the given tick."""
+        trajectory = self.trajectories[ion]
+        trajectory.extend([trajectory[-1]] * (tick + 1 - len(trajectory)))
+
+    def distance(self, node, goal):
+        if goal not in self._distances:
+            self._distances[goal] = nx.single_source_shortest_path_length(
+                self.free_graph, goal
+            )
+        return self._distances[goal].get(node, float("inf"))
+
+    def _can_move(self, ion, u, v, tick, partner, goal, min_tick):
+        for j in range(len(self.trajectories)):
+            if j == ion:
+                continue
+            p_now = self.position(j, tick)
+            p_next = self.position(j, tick + 1)
+            if p_next == v and not (j == partner and v == goal and tick + 1 >= min_tick):
+                return False
+            if u != v and p_now == v and p_next == u:
+                return False
+        return True
+
+    def _can_park(self, ion, node, tick, partner):
+        for j in range(len(self.trajectories)):
+            if j == ion or j == partner:
+                continue
+            for t in range(tick, max(self.end(j), tick) + 1):
+                if self.position(j, t) == node:
+                    return False
+        return True
+
+    @profiling.timed("SpaceTimeRouter.plan")
+    def plan(self, ion, start_tick, goal, min_tick=0, partner=None):
+        """
+        Move an ion to a goal node.
+
+        Args:
+            ion (int): The ion to move.
+            start_tick (int): Tick from which the ion may move. It has to be
+                after the end of the ion's trajectory.
+            goal (tuple): The node to reach.
+            min_tick (int): Earliest tick at which the goal may be reached.
+            partner (int): Ion allowed to be on the goal node on arrival, the
+                partner of an MS gate.
+
+        Returns:
+            int: The arrival tick, or None if the goal can't be reached.
+        """
+        self.wait(ion, start_tick)
+        start = self.trajectories[ion][start_tick]
+        came_from = {(start, start_tick): None}
+        heap = [(start_tick + self.distance(start, goal), start_tick, start)]
+        while heap:
+            _, tick, node = heapq.heappop(heap)
+            if (
+                node == goal
+                and tick >= min_tick
+                and self._can_park(ion, node, tick, partner)
+            ):
+                path = []
+                state = (node, tick)
+                while state is not None:
+                    path.append(state[0])
+                    state = came_from[state]
+                del self.trajectories[ion][start_tick:]
+                self.trajectories[ion].extend(reversed(path))
+                return tick
+            if tick >= start_tick + self.horizon:
+                continue
+            if node == goal and partner is not None and self.position(partner, tick) == goal:
+                continue
+            for nxt in [node, *self.free_graph.neighbors(node)]:
+                state = (nxt, tick + 1)
+                if state in came_from:
+                    continue
+                if not self._can_move(ion, node, nxt, tick, partner, goal, min_tick):
+                    continue
+                came_from[state] = (node, tick)
+                heapq.heappush(heap, (tick + 1 + self.distance(nxt, goal), tick + 1, nxt))
+        return None
+
+    def add_single(self, gate, tick=0):
+        """Apply a single qubit gate at the first tick the ion is on a standard node."""
+        ion = gate[2]
+        tick = max(tick, self.last_gate[ion] + 1)
+        while self.graph.nodes[self.position(ion, tick)]["type"] != "standard":
+            tick += 1
+        self.gates.setdefault(tick, []).append(gate)
+        self.last_gate[ion] = tick
+
+    def _try_ms(self, gate, zone, tick):
+        ions = gate[2]
+        departs = [max(self.end(ion), self.last_gate[ion]) for ion in ions]
+        arrivals = [d + self.distance(self.position(ion, d), zone) for ion, d in zip(ions, departs)]
+        first, second = (0, 1) if arrivals[0] >= arrivals[1] else (1, 0)
+
+        target = max(tick, arrivals[first])
+        start = max(departs[first], target - (arrivals[first] - departs[first]))
+        arrival = self.plan(ions[first], start, zone, min_tick=target)
+        if arrival is None:
+            return None
+
+        start = max(departs[second], arrival - (arrivals[second] - departs[second]))
+        gate_tick = self.plan(ions[second], start, zone, min_tick=arrival, partner=ions[first])
+        if gate_tick is None:
+            return None
+        for ion in ions:
+            self.wait(ion, gate_tick + 1)
+
+        for order in (ions, ions[::-1]):
+            saved = [list(self.trajectories[ion]) for ion in ions]
+            if all(self.plan(ion, gate_tick + 1, self.homes[ion], gate_tick + 2) is not None for ion in order):
+                return gate_tick
+            for ion, trajectory in zip(ions, saved):
+                self.trajectories[ion] = trajectory
+        return None
+
+    def add_ms(self, gate, zone, tick=0, max_delay=50):
+        """
+        Bring both ions of an MS gate to an interaction node, apply the gate
+        and send them back home.
+
+        The ion arriving last is planned first and the other one is timed to
+        arrive with it, so ions don't wait on the interaction node.
+        """
+        ions = gate[2]
+        tick = max(tick, *(self.last_gate[ion] + 1 for ion in ions))
+        for delay in range(max_delay):
+            saved = [list(self.trajectories[ion]) for ion in ions]
+            gate_tick = self._try_ms(gate, zone, tick + delay)
+            if gate_tick is not None:
+                self.gates.setdefault(gate_tick, []).append(gate)
+                for ion in ions:
+                    self.last_gate[ion] = gate_tick + 1
+                return gate_tick
+            for ion, trajectory in zip(ions, saved):
+                self.trajectories[ion] = trajectory
+        raise ValueError(f"Could not route {gate} to interaction node {zone}.")
+
+    def history(self):
+        """
+        Returns:
+            tuple: The positions history and the gates schedule.
+        """
+        length = max(max(self.end(ion) for ion in range(len(self.homes))), *self.gates, 0) + 1
+        positions_history = [
+            [self.position(ion, t) for ion in range(len(self.homes))] for t in range(length)
+        ]
+        gates_schedule = [self.gates.get(t, []) for t in range(length)]
+        return positions_history, gates_schedule
+
+
+def route_annotated(annotated, graph, homes=None):
+    """
+    Turn an annotated schedule into a positions history and a gates schedule.
+
+    Args:
+        annotated (list): A list of (gate, zone, tick) as returned by
+            `allocator.allocate`.
+        graph (nx.Graph): The graph representing the Penning trap.
+        homes (list): The home position of each ion. Defaults to
+            `default_home_positions`.
+
+    Returns:
+        tuple: The positions history and the gates schedule.
+    """
+    if homes is None:
+        homes = default_home_positions(graph)
+    router = SpaceTimeRouter(graph, homes)
+    for gate, zone, tick in annotated:
+        if gate[0] == "MS":
+            router.add_ms(gate, zone, tick)
+        else:
+            router.add_single(gate, tick)
+    return router.history()
+
+
+@profiling.timed("route_pipelined")
+def route_pipelined(layers, graph, homes=None):
+    """
+    Allocate the MS gates to interaction nodes and route the result.
+
+    Args:
+        layers (list): A list of layers, each a list of gates.
+        graph (nx.Graph): The graph representing the Penning trap.
+        homes (list): The home position of each ion. Defaults to
+            `default_home_positions`.
+
+    Returns:
+        tuple: The positions history and the gates schedule.
+    """
+    from allocator import allocate
+
+    if homes is None:
+        homes = default_home_positions(graph)
+    return route_annotated(allocate(layers, graph, homes), graph, homes)
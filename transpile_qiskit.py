@@ -1,40 +1,178 @@
-from qiskit import QuantumCircuit, transpile
+from functools import lru_cache
+
+from qiskit import QuantumCircuit
 from qiskit.circuit.library import CRZGate
 import numpy as np
 from qiskit.converters import circuit_to_dag
+from qiskit.transpiler import generate_preset_pass_manager
+from qiskit.transpiler.passes import ElidePermutations, Split2QUnitaries
+
+import profiling
+
+
+def qft_circuit() -> QuantumCircuit:
+    """Circuit implementing the QFT."""
+    qc = QuantumCircuit(8)
+    for i in range(8):
+        qc.h(i)
+        for j in range(i + 1, 8):
+            qc.crz(np.pi / (2**(j - i)), j,  i)
+    for i in range(3):
+        qc.cx(i, 7 - i)
+        qc.cx(7 - i, i)
+        qc.cx(i, 7 - i)
+    return qc
+
+
+def load_circuit(path) -> QuantumCircuit:
+    """
+    Load a circuit from an OpenQASM 2 or OpenQASM 3 file.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        QuantumCircuit: The circuit.
+    """
+    with open(path) as f:
+        source = f.read()
+    return circuit_from_qasm(source)
+
+
+def circuit_from_qasm(source) -> QuantumCircuit:
+    """Parse an OpenQASM 2 or OpenQASM 3 program."""
+    if source.lstrip().startswith("OPENQASM 3"):
+        from qiskit import qasm3
+
+        return qasm3.loads(source)
+    from qiskit import qasm2
+
+    return qasm2.loads(source, custom_instructions=qasm2.LEGACY_CUSTOM_INSTRUCTIONS)
+
+
+def prepare_circuit(qc: QuantumCircuit, num_qubits=8) -> QuantumCircuit:
+    """
+    Make a circuit fit the trap: drop the final measurements and add idle
+    qubits up to the number of ions.
+
+    Args:
+        qc (QuantumCircuit): The circuit.
+        num_qubits (int): Number of ions in the trap.
+
+    Returns:
+        QuantumCircuit: A new circuit on `num_qubits` qubits.
+    """
+    qc = qc.remove_final_measurements(inplace=False)
+    if qc.num_qubits > num_qubits:
+        raise ValueError(
+            f"The circuit uses {qc.num_qubits} qubits, the trap only holds {num_qubits} ions."
+        )
+    padded = QuantumCircuit(num_qubits, global_phase=qc.global_phase)
+    padded.compose(qc, qubits=range(qc.num_qubits), inplace=True)
+    return padded
 
-# Circuit implementing the QFT.
-qc = QuantumCircuit(8)
-for i in range(8):
-    qc.h(i)
-    for j in range(i + 1, 8):
-        qc.crz(np.pi / (2**(j - i)), j,  i)
-for i in range(3):
-    qc.cx(i, 7 - i)
-    qc.cx(7 - i, i)
-    qc.cx(i, 7 - i)
-
-# Transpile into the native gate set.
-basis_gates = ['rxx', 'rx', 'ry']
-transpiled_qc = transpile(qc, basis_gates=basis_gates, optimization_level=3, approximation_degree=1.0)
-# print(transpiled_qc.depth())
 
-dag = circuit_to_dag(transpiled_qc)
-
-# Each layer is a list of gates that happen at a specific time step.
-layers = []
-for i, layer in enumerate(dag.layers()):
-    current_layer = []
-    for op in layer["graph"].op_nodes():
-        if op.name == "rx":
-            gate = ("RX", op.params[0], op.qargs[0]._index)
-        elif op.name == "ry":
-            gate = ("RY", op.params[0], op.qargs[0]._index)
-        else:
-            gate = ("MS", op.params[0], (op.qargs[0]._index, op.qargs[1]._index))
-        current_layer.append(gate)
-    layers.append(current_layer)
-    # print(str(current_layer) + ",")
+def reference_density_matrix(qc: QuantumCircuit) -> np.ndarray:
+    """
+    Density matrix of a circuit applied to |0...0>, in the wire order of
+    PennyLane, so it can be compared to the output of `verifier.compiled_circuit`.
+
+    Args:
+        qc (QuantumCircuit): A circuit without measurements.
+
+    Returns:
+        np.ndarray: The density matrix.
+    """
+    from qiskit.quantum_info import Statevector
+
+    # Qiskit puts qubit 0 last in the state vector, PennyLane puts wire 0 first.
+    state = Statevector(qc).reverse_qargs().data
+    return np.outer(state, state.conj())
+
+
+@lru_cache(maxsize=None)
+def native_pass_manager():
+    """
+    The optimization level 3 pass manager for the native gate set, without the
+    passes that turn swaps into a relabelling of the output qubits.
+
+    The layers can't express a relabelling: each wire is an ion, and the ions
+    are compared wire by wire with the target circuit.
+    """
+    basis_gates = ['rxx', 'rx', 'ry']
+    pass_manager = generate_preset_pass_manager(3, basis_gates=basis_gates, approximation_degree=1.0)
+    init = pass_manager.init
+    found = set()
+    for index in reversed(range(len(init))):
+        passes = init[index].to_flow_controller().tasks
+        if any(isinstance(p, ElidePermutations) for p in passes):
+            init.remove(index)
+            found.add(ElidePermutations)
+        elif any(isinstance(p, Split2QUnitaries) for p in passes):
+            init.replace(index, [
+                Split2QUnitaries(p.requested_fidelity, split_swap=False)
+                if isinstance(p, Split2QUnitaries) else p
+                for p in passes
+            ])
+            found.add(Split2QUnitaries)
+    missing = {ElidePermutations, Split2QUnitaries} - found
+    if missing:
+        # A renamed or moved pass would silently bring the relabelling back.
+        raise ValueError(
+            "The init stage of the preset pass manager has no "
+            + " or ".join(sorted(p.__name__ for p in missing)) + " pass."
+        )
+    return pass_manager
+
+
+@profiling.timed("transpile_native")
+def transpile_native(qc: QuantumCircuit) -> QuantumCircuit:
+    """Transpile into the native gate set."""
+    transpiled_qc = native_pass_manager().run(qc)
+    layout = transpiled_qc.layout
+    if layout is not None and layout.final_index_layout() != list(range(qc.num_qubits)):
+        raise ValueError("The transpiler permuted the output qubits.")
+    return transpiled_qc
+
+
+def circuit_layers(transpiled_qc: QuantumCircuit) -> list:
+    """
+    Each layer is a list of gates that happen at a specific time step.
+
+    Args:
+        transpiled_qc (QuantumCircuit): A circuit in the native gate set.
+
+    Returns:
+        list: The layers of the circuit.
+    """
+    dag = circuit_to_dag(transpiled_qc)
+
+    layers = []
+    for i, layer in enumerate(dag.layers()):
+        current_layer = []
+        for op in layer["graph"].op_nodes():
+            if op.name == "rx":
+                gate = ("RX", float(op.params[0]), op.qargs[0]._index)
+            elif op.name == "ry":
+                gate = ("RY", float(op.params[0]), op.qargs[0]._index)
+            elif op.name == "rxx":
+                gate = ("MS", float(op.params[0]), (op.qargs[0]._index, op.qargs[1]._index))
+            elif op.name == "barrier":
+                continue
+            else:
+                raise ValueError(f"Unsupported operation {op.name} in the transpiled circuit.")
+            current_layer.append(gate)
+        if current_layer:
+            layers.append(current_layer)
+        # print(str(current_layer) + ",")
+    return layers
+
+
+qc = qft_circuit()
+transpiled_qc = transpile_native(qc)
+# print(transpiled_qc.depth())
+layers = circuit_layers(transpiled_qc)
 # print(layers)
 
-print(transpiled_qc.draw(output='text'))
+if __name__ == "__main__":
+    print(transpiled_qc.draw(output='text'))
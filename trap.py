@@ -1,21 +1,37 @@
+from itertools import combinations
+
 import networkx as nx
 
+ROWS = 5
+COLS = 7
+INTERACTION_NODES = [(1, 1), (1, 3), (3, 1), (3, 3), (1, 5), (3, 5)]
+
 
-def create_trap_graph() -> nx.Graph:
+def create_trap_graph(rows=ROWS, cols=COLS, interaction_nodes=None) -> nx.Graph:
     """Create a graph representing the Penning trap.
 
     The Penning trap is represented as a grid of nodes, where each node can be
     either an interaction node or a standard node. The interaction nodes are
     connected to their corresponding idle nodes, and the standard nodes are
     connected to their neighboring standard nodes.
-    """
 
-    trap = nx.Graph()
+    Args:
+        rows (int): Number of rows of the grid.
+        cols (int): Number of columns of the grid.
+        interaction_nodes (list): The (row, col) nodes that act as interaction
+            zones, as tuples or lists. Defaults to the six zones of the challenge trap.
+    """
+    if interaction_nodes is None:
+        interaction_nodes = INTERACTION_NODES
+    interaction_nodes = {tuple(n) for n in interaction_nodes}
 
-    rows = 5
-    cols = 7
+    for r, c in interaction_nodes:
+        if not (0 <= r < rows and 0 <= c < cols):
+            raise ValueError(
+                f"Interaction node {(r, c)} is outside of the {rows}x{cols} grid."
+            )
 
-    interaction_nodes = [(1, 1), (1, 3), (3, 1), (3, 3), (1, 5), (3, 5)]
+    trap = nx.Graph()
 
     for r in range(rows):
         for c in range(cols):
@@ -39,3 +55,53 @@ def create_trap_graph() -> nx.Graph:
                 neighbor_id = (r + 1, c)
                 trap.add_edge(node_id, neighbor_id)
     return trap
+
+
+def lattice_interaction_nodes(rows, cols, row_step=2, col_step=2, row_offset=1, col_offset=1):
+    """
+    Place interaction nodes on a regular sub-lattice of the grid.
+
+    The defaults reproduce the challenge layout on a 5x7 grid.
+
+    Args:
+        rows (int): Number of rows of the grid.
+        cols (int): Number of columns of the grid.
+        row_step (int): Distance between two interaction rows.
+        col_step (int): Distance between two interaction columns.
+        row_offset (int): Row of the first interaction node.
+        col_offset (int): Column of the first interaction node.
+
+    Returns:
+        list: The interaction nodes as (row, col) tuples.
+    """
+    return [
+        (r, c)
+        for r in range(row_offset, rows, row_step)
+        for c in range(col_offset, cols, col_step)
+    ]
+
+
+def generate_interaction_patterns(rows, cols, min_zones=1, max_zones=None, **lattice):
+    """
+    Generate candidate interaction node patterns for a grid.
+
+    The candidates are all subsets of the regular lattice returned by
+    `lattice_interaction_nodes` with between `min_zones` and `max_zones` nodes.
+
+    Args:
+        rows (int): Number of rows of the grid.
+        cols (int): Number of columns of the grid.
+        min_zones (int): Smallest number of interaction nodes in a pattern.
+        max_zones (int): Largest number of interaction nodes in a pattern.
+            Defaults to the size of the lattice.
+        **lattice: Extra arguments passed to `lattice_interaction_nodes`.
+
+    Yields:
+        list: One interaction node pattern at a time.
+    """
+    candidates = lattice_interaction_nodes(rows, cols, **lattice)
+    if max_zones is None:
+        max_zones = len(candidates)
+    for k in range(min_zones, max_zones + 1):
+        for pattern in combinations(candidates, k):
+            yield list(pattern)
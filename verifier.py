@@ -1,23 +1,47 @@
-import pennylane as qml
+from functools import lru_cache
+
 import numpy as np
 
-mixed_device = qml.device("default.mixed", wires=8)
+import profiling
 
+# PennyLane is only imported once a simulation is needed, so that the
+# structural checks in `verify_structure` stay cheap to import.
 
-@qml.qnode(device=mixed_device)
-def circuit():
-    qml.QFT(wires=range(8))
 
-    # commnet out above, and add network here you want to test.
-    # from numpy import pi
-    # qml.RX(pi, wires=[0])
-    # qml.RY(pi/2, wires=[0])
-    # qml.Hadamard(wires=0)
+@lru_cache(maxsize=None)
+def get_mixed_device():
+    """The PennyLane `default.mixed` device, created on first use."""
+    import pennylane as qml
+
+    return qml.device("default.mixed", wires=8)
 
-    return qml.density_matrix(wires=range(8))
+
+@lru_cache(maxsize=None)
+def _reference_qnode():
+    import pennylane as qml
+
+    @qml.qnode(device=get_mixed_device())
+    def circuit():
+        qml.QFT(wires=range(8))
+
+        # commnet out above, and add network here you want to test.
+        # from numpy import pi
+        # qml.RX(pi, wires=[0])
+        # qml.RY(pi/2, wires=[0])
+        # qml.Hadamard(wires=0)
+
+        return qml.density_matrix(wires=range(8))
+
+    return circuit
 
 
-def compiled_circuit(gates_schedule) -> qml.QNode:
+def circuit():
+    """Density matrix of the default target circuit, the QFT(8)."""
+    return _reference_qnode()()
+
+
+@profiling.timed("verifier.compiled_circuit")
+def compiled_circuit(gates_schedule):
     """
     Build the compiled circuit from the gates schedule.
 
@@ -27,8 +51,9 @@ def compiled_circuit(gates_schedule) -> qml.QNode:
     Returns:
         qml.QNode: A Pennylane QNode representing the circuit.
     """
+    import pennylane as qml
 
-    @qml.qnode(device=mixed_device)
+    @qml.qnode(device=get_mixed_device())
     def circuit():
         for step in gates_schedule:
             for gate in step:
@@ -43,16 +68,21 @@ def compiled_circuit(gates_schedule) -> qml.QNode:
     return circuit
 
 
-def verifier(positions_history, gates_schedule, graph) -> None:
+@profiling.timed("verify_structure")
+def verify_structure(positions_history, gates_schedule, graph) -> None:
     """
-    Verify the positions and gates schedule of the circuit.
+    Check that the positions and gates schedule are legal on the trap.
+
+    Only the trap graph is needed, no simulation is run.
 
     Args:
         positions_history (list): A list of positions for each step in the circuit.
         gates_schedule (list): A list of gates where each gate is represented as a tuple.
         graph (networkx.Graph): The graph representing the Penning trap.
+
+    Raises:
+        ValueError: If a move, gate or overlap is not allowed.
     """
-    print("Verifying the positions history and gates schedule...")
     if len(positions_history) != len(gates_schedule):
         raise ValueError(
             f"Length of positions history ({len(positions_history)}) does not match length of gates schedule ({len(gates_schedule)})."
@@ -82,6 +112,7 @@ def verifier(positions_history, gates_schedule, graph) -> None:
 
             # Check for ions swapping over the same edge
             num_ions = len(curr_pos_tuple)
+            profiling.count("verify_structure.pair_checks", num_ions * (num_ions - 1) // 2)
             for ion1_idx in range(num_ions):
                 for ion2_idx in range(
                     ion1_idx + 1, num_ions
@@ -233,12 +264,53 @@ def verifier(positions_history, gates_schedule, graph) -> None:
                     raise ValueError(
                         f"Error: Overlapping ions at {overlap} at step {i} and step {i - 1} have conflicting MS gate. Only one MS gate should be present."
                     )
-    print("Positions and gates are valid.")
-    print("Verifying the fidelity of the circuit without adding noise...")
-    expected_result = circuit()
-    user_result = compiled_circuit(gates_schedule)()
+
+
+def verify_equivalence(gates_schedule, expected_result=None) -> None:
+    """
+    Check by simulation that the gates schedule implements the target circuit.
+
+    Args:
+        gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        expected_result (np.ndarray): Density matrix of the target circuit,
+            for example from `transpile_qiskit.reference_density_matrix`.
+            Defaults to running `circuit`, the QFT(8).
+
+    Raises:
+        ValueError: If the compiled circuit differs from the target circuit.
+    """
+    import pennylane as qml
+
+    if expected_result is None:
+        expected_result = circuit()
+    qnode = compiled_circuit(gates_schedule)
+    with profiling.timer("verifier.simulate"):
+        user_result = qnode()
     user_fidelity = qml.math.fidelity(expected_result, user_result)
     print("Fidelity of the circuit:", user_fidelity)
     if not np.allclose(expected_result, user_result, atol=1e-5):
-        raise ValueError("The compiled circuit does not implement QFT(8).")
-    print("The compiled circuit implements QFT(8).")
+        raise ValueError("The compiled circuit does not implement the target circuit.")
+
+
+def verifier(positions_history, gates_schedule, graph, expected_result=None, simulate=True) -> None:
+    """
+    Verify the positions and gates schedule of the circuit.
+
+    Args:
+        positions_history (list): A list of positions for each step in the circuit.
+        gates_schedule (list): A list of gates where each gate is represented as a tuple.
+        graph (networkx.Graph): The graph representing the Penning trap.
+        expected_result (np.ndarray): Density matrix of the target circuit,
+            for example from `transpile_qiskit.reference_density_matrix`.
+            Defaults to running `circuit`, the QFT(8).
+        simulate (bool): Also check by simulation that the schedule implements
+            the target circuit.
+    """
+    print("Verifying the positions history and gates schedule...")
+    verify_structure(positions_history, gates_schedule, graph)
+    print("Positions and gates are valid.")
+    if not simulate:
+        return
+    print("Verifying the fidelity of the circuit without adding noise...")
+    verify_equivalence(gates_schedule, expected_result)
+    print("The compiled circuit implements the target circuit.")